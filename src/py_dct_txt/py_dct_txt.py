@@ -1,11 +1,13 @@
 """Main module."""
 
 import json
-import re
+import os
 import sys
 from collections import defaultdict
 from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from typing import (
     Any,
@@ -15,16 +17,20 @@ from typing import (
 )
 
 from .utils import (
+    LINE_SEPARATOR_PATTERN,
     FastScalarParser,
     extract_inline_comments,
+    fast_emit_scalar,
+    json_flow_loads,
     normalize_to_ascii,
-    split_by_first_sep,
+    scalar_flow_loads,
     yaml_flow_dumps,
     yaml_flow_loads,
+    yaml_flow_loads_rows,
 )
 
 
-@dataclass
+@dataclass(slots=True)
 class DctTxtItem:
     k: str = ""
     anchor: str = ""
@@ -41,26 +47,33 @@ DctTxtList: TypeAlias = list[DctTxtListItem]
 
 
 class DctTxt:
-    LINE_SEPARATOR_PATTERN = re.compile(r"(:=|=>|>>|<>)")
+    LINE_SEPARATOR_PATTERN = LINE_SEPARATOR_PATTERN
 
-    def read_as_list(self, fp: TextIO | Iterable[str]):
-        res: DctTxtList = []
+    def read_as_list(self, fp: TextIO | Iterable[str]) -> DctTxtList:
+        return list(self.iter_as_list(fp))
+
+    def iter_as_list(self, fp: TextIO | Iterable[str]) -> Iterator[DctTxtListItem]:
+        # hot loop, keep lookups local
+        extract = extract_inline_comments
+        # same as split_by_first_sep, inlined
+        split_sep = self.LINE_SEPARATOR_PATTERN.split
+        format_item = self.format_list_item
         for row in fp:
-            first = ""
-            comments, code = extract_inline_comments(row.rstrip())
-            if row.startswith("/*"):
-                if comments:
-                    first = comments.pop(0)
-            res.append(
-                self.format_list_item(
-                    (
-                        first,
-                        *split_by_first_sep(self.LINE_SEPARATOR_PATTERN, code),
-                        comments,
-                    )
-                )
-            )
-        return res
+            code = row.rstrip()
+            if not code:
+                # same as format_item of an empty row
+                yield ("", "", "", "", [])
+                continue
+            # most rows have no comment, skip the regex for them
+            if "/*" in code:
+                comments, code = extract(code)
+                first = comments.pop(0) if comments and row.startswith("/*") else ""
+            else:
+                comments = []
+                first = ""
+            parts = split_sep(code, 1)
+            k, sep, v = parts if len(parts) == 3 else (code, "", "")
+            yield format_item((first, k, sep, v, comments))
 
     def _merge_item(self, dst: DctTxtItem, other: DctTxtItem):
         if other.k:
@@ -86,29 +99,116 @@ class DctTxt:
     ) -> bool | None:
         return False
 
-    def _bind_value(self, current: DctTxtItem, list_item: DctTxtListItem):
-        _, _, c_sep, c_v, _ = list_item
+    def _bind_l(self, current: DctTxtItem, list_item: DctTxtListItem, deferred):
+        current.l = [v.strip() for v in list_item[3].split("||")]
+
+    def _bind_s(self, current: DctTxtItem, list_item: DctTxtListItem, deferred):
+        current.s = list_item[3].strip()
+
+    def _bind_v(self, current: DctTxtItem, list_item: DctTxtListItem, deferred):
+        c_v = list_item[3]
+        r = scalar_flow_loads(c_v)
+        if r is FastScalarParser.EMPTY_RESULT:
+            r = json_flow_loads(c_v)
+        if r is not FastScalarParser.EMPTY_RESULT:
+            current.v = r
+        elif deferred is not None and self._can_batch(c_v):
+            deferred.append((current, list_item))
+        else:
+            current.v = yaml_flow_loads("{v: " + c_v + "}")["v"]
+
+    def _bind_kvs(self, current: DctTxtItem, list_item: DctTxtListItem, deferred):
+        c_v = list_item[3]
+        if not c_v or c_v.isspace():
+            current.kvs = {}
+        elif deferred is not None and self._can_batch(c_v):
+            deferred.append((current, list_item))
+        else:
+            current.kvs = yaml_flow_loads("{" + c_v + "}")
+
+    # method names, so that subclasses can override the handlers
+    _SEP_HANDLERS = {
+        ":=": "_bind_l",
+        "=>": "_bind_s",
+        ">>": "_bind_v",
+        "<>": "_bind_kvs",
+    }
+
+    def _bind_value(
+        self,
+        current: DctTxtItem,
+        list_item: DctTxtListItem,
+        deferred: list[tuple[DctTxtItem, DctTxtListItem]] | None = None,
+    ):
+        """
+        deferred: if given, values that need the YAML loader are appended to it
+        instead of being parsed, see `_bind_yaml_batch`
+        """
+        name = self._SEP_HANDLERS.get(list_item[2])
+        if name is None:
+            return
         try:
-            match c_sep:
-                case ":=":
-                    current.l = list(map(lambda v: v.strip(), c_v.split("||")))
-                case "=>":
-                    current.s = c_v.strip()
-                case ">>":
-                    current.v = yaml_flow_loads("{v: " + c_v + "}")["v"]
-                case "<>":
-                    current.kvs = yaml_flow_loads("{" + c_v + "}")
-                case _:
-                    pass
+            getattr(self, name)(current, list_item, deferred)
         except Exception as e:
             print(e, file=sys.stderr)
 
-    def load_dict(self, dct_list: DctTxtList):
+    # very large flow documents get slower again in libyaml
+    YAML_BATCH_SIZE = 256
+
+    @staticmethod
+    def _can_batch(c_v: str) -> bool:
+        # anchors/aliases would resolve across rows of one batch document
+        return "&" not in c_v and "*" not in c_v
+
+    def _bind_yaml_batch(self, deferred: list[tuple[DctTxtItem, DctTxtListItem]]):
+        n = self.YAML_BATCH_SIZE
+        for i in range(0, len(deferred), n):
+            self._bind_yaml_chunk(deferred[i : i + n])
+
+    def _bind_yaml_chunk(self, deferred: list[tuple[DctTxtItem, DctTxtListItem]]):
+        if not deferred:
+            return
+        res = yaml_flow_loads_rows(
+            [
+                "{v: " + c_v + "}" if c_sep == ">>" else "{" + c_v + "}"
+                for _, (_, _, c_sep, c_v, _) in deferred
+            ]
+        )
+        if res is None or not all(isinstance(r, dict) for r in res):
+            # malformed rows: bisect to isolate them
+            if len(deferred) == 1:
+                self._bind_value(*deferred[0])
+            else:
+                mid = len(deferred) // 2
+                self._bind_yaml_chunk(deferred[:mid])
+                self._bind_yaml_chunk(deferred[mid:])
+            return
+        for (current, (_, _, c_sep, _, _)), r in zip(deferred, res, strict=True):
+            if c_sep == ">>":
+                current.v = r.get("v")
+            else:
+                current.kvs = r
+
+    def load_dict(self, dct_list: Iterable[DctTxtListItem]):
         g = {}
         d: dict[str, DctTxtItem] = {}
         last_key = ""
+        anchor_prefix = "\t_"
         anchor = ""
         using_anchor = 0
+        pending: list[tuple[str, DctTxtItem]] = []
+        deferred: list[tuple[DctTxtItem, DctTxtListItem]] = []
+
+        def flush():
+            self._bind_yaml_batch(deferred)
+            for key, current in pending:
+                if key in d:
+                    d[key] = self._merge_item(d[key], current)
+                else:
+                    d[key] = current
+            pending.clear()
+            deferred.clear()
+
         for item in dct_list:
             c_cf, c_k, _, _, c_ca = item
             if c_k:
@@ -117,7 +217,9 @@ class DctTxt:
                 last_key = c_k
             else:
                 using_anchor += 1
-                anchor = f"{last_key}\t_{using_anchor:05d}"
+                if using_anchor == 1:
+                    anchor_prefix = last_key + "\t_"
+                anchor = f"{anchor_prefix}{using_anchor:05d}"
             current = DctTxtItem(
                 k=c_k,
                 anchor=anchor,
@@ -126,45 +228,47 @@ class DctTxt:
             )
             bindable: bool | None = True
             if c_cf.startswith("/*!"):
+                # scripts may inspect `d`, bring it up to date first
+                flush()
                 bindable = self._run_script(item, d, g)
             if bindable is False:
                 continue
-            self._bind_value(current, item)
-            key = c_k or anchor
-            if key in d:
-                d[key] = self._merge_item(d[key], current)
-            else:
-                d[key] = current
+            if item[2]:
+                self._bind_value(current, item, deferred)
+            pending.append((c_k or anchor, current))
+        flush()
         return d, g
 
     def read_as_dict(self, fp: TextIO | Iterable[str]):
-        ls = self.read_as_list(fp)
-        return self.load_dict(ls)
+        return self.load_dict(self.iter_as_list(fp))
 
     def dump_dict(self, dct: dict[str, DctTxtItem]):
         res: DctTxtList = []
+        extend = res.extend
         for item in dct.values():
-            for cmt in item.comment_before:
-                res.append((cmt, item.k, "", "", []))
+            k = item.k
+            v = item.v
+            comment_after = item.comment_after
+            buf: DctTxtList = [(cmt, k, "", "", []) for cmt in item.comment_before]
             if item.l:
-                res.append(("", item.k, ":=", " || ".join(item.l), []))
+                buf.append(("", k, ":=", " || ".join(item.l), []))
             if item.s:
-                res.append(("", item.k, "=>", item.s, []))
-            if len(item.kvs):
-                res.append(("", item.k, "<>", yaml_flow_dumps(item.kvs)[1:-1], []))
-            if item.v is not None:
-                v = yaml_flow_dumps(item.v).strip()
-                if v.endswith("\n..."):
-                    v = v[:-4]
-                v = v.strip()
-                res.append(("", item.k, ">>", v, []))
-            if item.comment_after:
-                c_cf, _, c_sep, c_v, _ = (
-                    res.pop()
-                    if res and res[-1][1] == item.k
-                    else ("", "", "", "", None)  # None will be ignored (_)
-                )
-                res.append((c_cf, item.k, c_sep, c_v, item.comment_after))
+                buf.append(("", k, "=>", item.s, []))
+            if item.kvs:
+                buf.append(("", k, "<>", yaml_flow_dumps(item.kvs)[1:-1], []))
+            if v is not None:
+                dumped = fast_emit_scalar(v)
+                if dumped is None:
+                    dumped = yaml_flow_dumps(v).strip()
+                    if dumped.endswith("\n..."):
+                        dumped = dumped[:-4]
+                    dumped = dumped.strip()
+                buf.append(("", k, ">>", dumped, []))
+            if comment_after:
+                # None will be ignored (_)
+                c_cf, _, c_sep, c_v, _ = buf.pop() if buf else ("", "", "", "", None)
+                buf.append((c_cf, k, c_sep, c_v, comment_after))
+            extend(buf)
         return res
 
     def get_list_batch(self, l: DctTxtList, batch_size=1000, max_extra=10):
@@ -184,29 +288,41 @@ class DctTxt:
             i = end
 
     def save_list(self, l: DctTxtList, fp: TextIO | None = None, *, batch_size=10000):
+        """
+        return the lines if fp is None, otherwise lines are streamed to fp
+        in batches and an empty list is returned
+        """
         lines = []
+        written = False
         for item in l:
             first_comment, key, sep, value, inline_comments = item
 
-            parts = []
+            # same as " ".join of the non-empty parts
             if first_comment:
-                parts.append(first_comment)
-            if key:
-                parts.append(key)
+                line = f"{first_comment} {key}" if key else first_comment
+            else:
+                line = key
             if sep:
-                parts.extend([sep, value])
+                line = f"{line} {sep} {value}" if line else f"{sep} {value}"
             elif value:
                 ...
             if inline_comments:
-                parts.extend(inline_comments)
-            lines.append(" ".join(parts).rstrip())
-        if fp is not None:
-            for i in range(0, len(lines), batch_size):
-                batch = lines[i : i + batch_size]
-                fp.write("\n".join(batch))
-                if i + batch_size < len(lines):
+                comments = " ".join(inline_comments)
+                line = f"{line} {comments}" if line else comments
+            lines.append(line.rstrip())
+            if fp is not None and len(lines) >= batch_size:
+                if written:
                     fp.write("\n")
-        return lines
+                fp.write("\n".join(lines))
+                lines.clear()
+                written = True
+        if fp is None:
+            return lines
+        if lines:
+            if written:
+                fp.write("\n")
+            fp.write("\n".join(lines))
+        return []
 
     def save_dict(
         self, dct: dict[str, DctTxtItem], fp: TextIO | None = None, *, batch_size=10000
@@ -235,16 +351,40 @@ class DctTxt:
 NestedDict = dict[str, dict[str, DctTxtItem]]
 
 
+@lru_cache(maxsize=4096)
+def _index_of_first_char(c: str) -> str:
+    first = normalize_to_ascii(c)
+    first = first[0] if first else "#"
+    return first.lower() if first.isascii() and first.isalpha() else "#"
+
+
+# ASCII and Latin-1 cover most keys, precompute them indexed by code point
+_FIRST_CHAR_INDEX = [_index_of_first_char(chr(cp)) for cp in range(256)]
+
+
 class DctTxtStore:
     @classmethod
-    def transpose_dict(cls, nested_dict: NestedDict) -> NestedDict:
-        res = defaultdict(dict)
+    def transpose_dict(
+        cls, nested_dict: NestedDict, keys: Iterable[str] | None = None
+    ) -> NestedDict:
+        """
+        keys: only transpose these outer keys (in this order)
+        """
+        res: NestedDict = {}
+        get = res.get
+        items = (
+            nested_dict.items() if keys is None else ((k, nested_dict[k]) for k in keys)
+        )
 
-        for outer_key, inner_dict in nested_dict.items():
+        for outer_key, inner_dict in items:
             for inner_key, value in inner_dict.items():
-                res[inner_key][outer_key] = value
+                d = get(inner_key)
+                if d is None:
+                    res[inner_key] = {outer_key: value}
+                else:
+                    d[outer_key] = value
 
-        return dict(res)
+        return res
 
     @classmethod
     def file_line_iter(cls, files: list[Path]) -> Iterator[str]:
@@ -253,21 +393,42 @@ class DctTxtStore:
             with open(path, encoding="utf-8") as f:
                 yield from f
 
-    GROUP_NAME_PATTERN = re.compile(r"^([^/]+?)(?:__\d+)?\.dct\.txt$")
-
     @classmethod
     def extract_groupname(cls, filename: str):
-        match = cls.GROUP_NAME_PATTERN.match(filename)
-        if match:
-            return match.group(1)
-        return "unknown"
+        # <name>[__<n>].dct.txt
+        if not filename.endswith(".dct.txt") or "/" in filename:
+            return "unknown"
+        stem = filename[: -len(".dct.txt")]
+        if not stem:
+            return "unknown"
+        head, _, tail = stem.rpartition("__")
+        if head and tail.isdecimal():
+            return head
+        return stem
 
     saved_info_filename = "_dct_txt_info.json"
 
-    def __init__(self, *, serializer: DctTxt | None = None) -> None:
+    def __init__(
+        self,
+        *,
+        serializer: DctTxt | None = None,
+        max_workers: int = 1,
+        parse_cache_size: int = 0,
+    ) -> None:
+        """
+        max_workers: threads used to parse groups in `load`, 1 (default) disables
+            the pool. With more, groups are bound concurrently through the one
+            `serializer`, so its handlers must be thread-safe
+        parse_cache_size: number of groups whose parsed rows are kept between
+            loads (keyed by path, mtime and size), 0 disables the cache
+        """
         self.read_files: set[Path] = set()
         self.saved_files: set[Path] = set()
         self.serializer = DctTxt() if serializer is None else serializer
+        self.max_workers = max_workers
+        self.parse_cache_size = parse_cache_size
+        # (path, mtime_ns, size) of every file in a group -> its parsed rows
+        self._parse_cache: dict[tuple, list[tuple[str, str, str, str, tuple]]] = {}
 
     def load(self, path: Path):
         """
@@ -277,8 +438,8 @@ class DctTxtStore:
         files: list[Path] = []
         if path.exists():
             if path.is_dir():
-                files.extend(sorted(path.glob("**/*.dct.txt")))
-                self.read_files.update(path.glob(f"**/{self.saved_info_filename}"))
+                files, info_files = self._scan_store_files(path)
+                self.read_files.update(info_files)
             elif path.is_file() and path.name.endswith(".dct.txt"):
                 files.append(path)
         file_groups = defaultdict(list)
@@ -286,37 +447,102 @@ class DctTxtStore:
             file_groups[self.extract_groupname(file.name)].append(file)
         file_groups = dict(file_groups)
         group_dict: NestedDict = {}
-        for name, group in file_groups.items():
-            data, _ = self.serializer.read_as_dict(self.file_line_iter(group))
+        workers = min(self.max_workers, len(file_groups))
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as ex:
+                results = list(ex.map(self._load_group, file_groups.values()))
+        else:
+            results = [self._load_group(group) for group in file_groups.values()]
+        for name, data in zip(file_groups, results, strict=True):
             if len(data) == 0:
                 continue
             group_dict[name] = data
         self.read_files.update(files)
+        # evict the oldest groups, outside of the worker threads
+        cache = self._parse_cache
+        while len(cache) > self.parse_cache_size:
+            del cache[next(iter(cache))]
         key_dict = self.transpose_dict(group_dict)
         return key_dict
 
+    @classmethod
+    def _scan_store_files(cls, root: Path) -> tuple[list[Path], list[Path]]:
+        """
+        one pass for both data and info files, same traversal as os.walk
+        return sorted data files, info files
+        """
+        files: list[str] = []
+        info_files: list[Path] = []
+        stack = [os.fspath(root)]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.is_dir():
+                        # like os.walk(followlinks=False)
+                        if not entry.is_symlink():
+                            stack.append(entry.path)
+                    elif entry.name.endswith(".dct.txt"):
+                        files.append(entry.path)
+                    elif entry.name == cls.saved_info_filename:
+                        info_files.append(Path(entry.path))
+        return sorted(map(Path, files)), info_files
+
+    def _load_group(self, group: list[Path]) -> dict[str, DctTxtItem]:
+        if self.parse_cache_size <= 0:
+            data, _ = self.serializer.read_as_dict(self.file_line_iter(group))
+            return data
+        cache = self._parse_cache
+        stats = []
+        for path in group:
+            st = path.stat()
+            stats.append((str(path), st.st_mtime_ns, st.st_size))
+        key = tuple(stats)
+        rows = cache.get(key)
+        if rows is None:
+            # comments as tuples, so cached rows can not be changed through items
+            rows = [
+                (c_cf, c_k, c_sep, c_v, tuple(c_ca))
+                for c_cf, c_k, c_sep, c_v, c_ca in self.serializer.iter_as_list(
+                    self.file_line_iter(group)
+                )
+            ]
+            cache[key] = rows
+        data, _ = self.serializer.load_dict(
+            (c_cf, c_k, c_sep, c_v, list(c_ca)) for c_cf, c_k, c_sep, c_v, c_ca in rows
+        )
+        return data
+
     def create_index_map(self, keys: Collection[str]) -> dict[str, list[str]]:
         if len(keys) < 1000:
             return {"": list(keys)}
-        res = defaultdict(list)
+        res: dict[str, list[str]] = {}
+        table = _FIRST_CHAR_INDEX
+        index_of = _index_of_first_char
+        # classify each distinct first char once, then append straight to its bucket
+        appends = {}
         for key in keys:
-            first = normalize_to_ascii(key[0])
-            first = first[0] if first else "#"
-            res[first.lower() if first.isascii() and first.isalpha() else "#"].append(
-                key
-            )
-        res: dict[str, list[str]] = dict(res)
+            c = key[0]
+            append = appends.get(c)
+            if append is None:
+                o = ord(c)
+                index = table[o] if o < 256 else index_of(c)
+                append = appends[c] = res.setdefault(index, []).append
+            append(key)
         return res
 
     def save(self, key_dict: NestedDict, path: Path, *, batch_size=5000):
+        self._parse_cache.clear()
         key_dict = self.sort_dict_key(key_dict)
         index_map = self.create_index_map(key_dict.keys())
+        infos: dict[Path, dict] = {}
         for index, keys in index_map.items():
             index_path = path / index
-            info_file = index_path / self.saved_info_filename
-            info = {}
-            idx_key_dict = {k: key_dict[k] for k in keys}
-            idx_group_dict = self.transpose_dict(idx_key_dict)
+            info = infos.setdefault(index_path / self.saved_info_filename, {})
+            idx_group_dict = self.transpose_dict(key_dict, keys)
             for name, group in idx_group_dict.items():
                 group_l = self.serializer.dump_dict(group)
                 if len(group_l):
@@ -340,8 +566,12 @@ class DctTxtStore:
                         "end": last_file_key,
                         "total": len(batch),
                     }
+        for info_file, info in infos.items():
+            if not info:
+                # nothing was written to this directory
+                continue
             info = {k: v for k, v in sorted(info.items(), key=lambda i: i[0])}
-            with open(info_file, "w") as f:
+            with open(info_file, "w", encoding="utf-8") as f:
                 json.dump(info, f, ensure_ascii=False, indent=4)
             self.saved_files.add(info_file)
 
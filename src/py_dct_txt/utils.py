@@ -1,17 +1,25 @@
+import io
 import json
 import math
+import os
 import re
 import unicodedata
 from functools import lru_cache
 from typing import Final, Union
 
 import yaml
+from yaml.resolver import Resolver
 
 try:
     YamlLoader = yaml.CSafeLoader
     YamlDumper = yaml.CSafeDumper
     YAML_DUMPER_WIDTH = 2147483647
-except:
+except AttributeError:
+    # 纯 Python 版本慢一个数量级, CI 等场景可以要求必须使用 libyaml
+    if os.environ.get("PY_DCT_TXT_REQUIRE_LIBYAML"):
+        raise ImportError(
+            "PyYAML is not built with libyaml (PY_DCT_TXT_REQUIRE_LIBYAML is set)"
+        ) from None
     YamlLoader = yaml.SafeLoader
     YamlDumper = yaml.SafeDumper
     YAML_DUMPER_WIDTH = float("inf")
@@ -116,12 +124,12 @@ class FastScalarParser:
                 pass
         return cls.EMPTY_RESULT
 
-    _INVALID_SQ_RE = re.compile(r"(?<!')'(?!')")
     _INVALID_DQ_RE = re.compile(r'(?<!\\)"')
 
     @classmethod
     def _parse_single_quoted(cls, s: str):
-        if cls._INVALID_SQ_RE.search(s):
+        # '' 从左到右成对转义, 剩下的单引号说明字符串已提前结束
+        if "'" in s.replace("''", ""):
             return cls.EMPTY_RESULT
         return s.replace("''", "'")
 
@@ -150,7 +158,11 @@ class FastScalarParser:
         temp = cls._YAML_U8_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 16)), temp)
         # 处理\ooo
         temp = cls._YAML_OCT_ESCAPE_RE.sub(lambda m: chr(int(m.group(1), 8)), temp)
-        return json.loads(temp)
+        try:
+            return json.loads(temp)
+        except ValueError:
+            # 其他 YAML 转义 (\x41, \N, \_ ...) 交给 YAML 处理
+            return cls.EMPTY_RESULT
 
 
 def _represent_none(dumper: yaml.CSafeDumper, _):
@@ -164,43 +176,221 @@ class CustomSafeDumper(YamlDumper):  # pyright: ignore[reportGeneralTypeIssues]
 CustomSafeDumper.add_representer(type(None), _represent_none)
 
 
+_FLOW_DUMPER_OPTIONS = dict(
+    # 不换行
+    default_flow_style=True,
+    width=YAML_DUMPER_WIDTH,
+    # 省引号
+    default_style=None,
+    allow_unicode=True,
+    # 取消缩进（行内无需）
+    indent=0,
+    sort_keys=False,
+)
+
+
 def yaml_flow_dumps(data) -> str:
-    result = yaml.dump(
-        data,
-        # stream,
-        Dumper=CustomSafeDumper,
-        # 不换行
-        default_flow_style=True,
-        width=YAML_DUMPER_WIDTH,
-        # 省引号
-        default_style=None,
-        allow_unicode=True,
-        # 取消缩进（行内无需）
-        indent=0,
-        sort_keys=False,
-    )
-    return (
-        result.strip().replace(": !!null '_NULL'", "").replace("!!null '_NULL'", "null")
-    )
+    # 等同 yaml.dump(data, Dumper=CustomSafeDumper, **_FLOW_DUMPER_OPTIONS),
+    # 省去 dump_all 的参数转发
+    stream = io.StringIO()
+    dumper = CustomSafeDumper(stream, **_FLOW_DUMPER_OPTIONS)
+    try:
+        dumper.open()
+        dumper.represent(data)
+        dumper.close()
+    finally:
+        dumper.dispose()
+    result = stream.getvalue().strip()
+    if "_NULL" not in result:
+        return result
+    return result.replace(": !!null '_NULL'", "").replace("!!null '_NULL'", "null")
+
+
+_yaml_resolver = Resolver()
+_YAML_STR_TAG = "tag:yaml.org,2002:str"
+
+
+def fast_emit_scalar(v) -> str | None:
+    """
+    不经过 yaml.dump 输出标量, 结果与 yaml_flow_dumps 一致
+    Returns:
+        需要完整 YAML 输出时返回 None
+    """
+    t = type(v)
+    if t is str:
+        # 与读取时的 FastScalarParser 保持一致, 且 YAML 也解析为字符串
+        if (
+            v
+            and v[0] not in ",`"
+            and not v.startswith("...")
+            and v.isprintable()
+            and max(v) <= "\ufffd"
+            and FastScalarParser.parse(v) == v
+            and _yaml_resolver.resolve(yaml.ScalarNode, v, (True, False))
+            == _YAML_STR_TAG
+        ):
+            return v
+        return None
+    if t is bool:
+        return "true" if v else "false"
+    if t is int:
+        return str(v)
+    if t is float:
+        if v != v:
+            return ".nan"
+        if v in (math.inf, -math.inf):
+            return ".inf" if v > 0 else "-.inf"
+        value = repr(v).lower()
+        if "." not in value and "e" in value:
+            value = value.replace("e", ".0e", 1)
+        return value
+    if v is None:
+        return "null"
+    return None
 
 
 def yaml_flow_loads(yaml_str) -> dict:
     return yaml.load(yaml_str, Loader=YamlLoader)
 
 
-_inline_comment_pattern = re.compile(r"/\*.*?\*/")
+def yaml_flow_loads_rows(rows: list[str]) -> list | None:
+    """
+    把多个单行的 flow 文档放进一个序列, 一次解析
+    Returns:
+        解析失败, 或有元素没有恰好占据自己那一行时返回 None
+    """
+    # 每个元素一行, 使 # 注释不能吞掉后面的行
+    loader = YamlLoader("[" + "\n,".join(rows) + "\n]")
+    try:
+        node = loader.get_single_node()
+        if not isinstance(node, yaml.SequenceNode) or len(node.value) != len(rows):
+            return None
+        for i, item in enumerate(node.value):
+            # 未闭合的引号会延续到下一行, 多余的 }, { 会在同一行多出元素
+            if item.start_mark.line != i or item.end_mark.line != i:
+                return None
+        return loader.construct_document(node)
+    except Exception:
+        return None
+    finally:
+        loader.dispose()
+
+
+# 与 _yaml_resolver.resolve(yaml.ScalarNode, s, (True, False)) 相同, 省去通用逻辑
+_implicit_resolvers = Resolver.yaml_implicit_resolvers
+
+
+def _plain_scalar_tag(s: str) -> str:
+    for tag, regexp in _implicit_resolvers.get(s[:1], ()):
+        if regexp.match(s):
+            return tag
+    return _YAML_STR_TAG
+
+
+_YAML_INT_TAG = "tag:yaml.org,2002:int"
+_YAML_FLOAT_TAG = "tag:yaml.org,2002:float"
+
+
+def scalar_flow_loads(s: str):
+    """
+    FastScalarParser 的结果与 YAML 1.1 的类型一致时才采用 (1e5, yes, 1_000 等交给 YAML)
+    Returns:
+        不能保证与 yaml_flow_loads 一致时返回 FastScalarParser.EMPTY_RESULT
+    """
+    r = FastScalarParser.parse(s)
+    t = type(r)
+    # FastScalarParser 认出的 bool 和 null 写法在 YAML 中也是 bool 和 null
+    if r is FastScalarParser.EMPTY_RESULT or t is bool or r is None:
+        return r
+    s = s.strip()
+    # 不可打印字符和 \x85, \u2028 等换行, YAML 会报错或折叠
+    if not s.isprintable():
+        return FastScalarParser.EMPTY_RESULT
+    # 带引号的总是字符串; 双引号的转义由 YAML 处理 (如 "\\a" 不能逐个替换)
+    if s[0] == "'":
+        return r
+    if s[0] == '"':
+        return FastScalarParser.EMPTY_RESULT if "\\" in s else r
+    # {v: ...} 中的逗号是 flow 分隔符
+    if "," in s:
+        return FastScalarParser.EMPTY_RESULT
+    if t is str:
+        expected = _YAML_STR_TAG
+    elif t is int:
+        digits = s.lstrip("+-")
+        if digits.isascii() and digits.isdigit():
+            # YAML 1.1 中 0 开头的整数是八进制
+            if digits[0] == "0" and len(digits) > 1:
+                return FastScalarParser.EMPTY_RESULT
+            return r
+        expected = _YAML_INT_TAG
+    else:
+        expected = _YAML_FLOAT_TAG
+    if _plain_scalar_tag(s) != expected:
+        return FastScalarParser.EMPTY_RESULT
+    return r
+
+
+def _json_parse_float(s: str):
+    # YAML 1.1 的浮点数必须带小数点, 1e5 之类解析为字符串
+    if _yaml_resolver.resolve(yaml.ScalarNode, s, (True, False)) == _YAML_STR_TAG:
+        return s
+    return float(s)
+
+
+def _json_reject_constant(s: str):
+    raise ValueError(s)
+
+
+_json_flow_decoder = json.JSONDecoder(
+    parse_float=_json_parse_float, parse_constant=_json_reject_constant
+)
+
+
+def json_flow_loads(s: str):
+    """
+    与 JSON 兼容的 flow 集合 ([1, "a"], {"k": null} 等) 用 json 解析, 快一个数量级
+    Returns:
+        无法保证与 yaml_flow_loads 一致时返回 FastScalarParser.EMPTY_RESULT
+    """
+    s = s.strip()
+    if (
+        not s
+        or s[0] not in "[{"
+        # 转义和不可打印字符的规则两者不同
+        or "\\" in s
+        or not s.isprintable()
+        # dump 出的 dict 键不带引号, 直接跳过
+        or (s[0] == "{" and s[1:].lstrip()[:1] not in ('"', "}"))
+    ):
+        return FastScalarParser.EMPTY_RESULT
+    try:
+        return _json_flow_decoder.decode(s)
+    except ValueError:
+        return FastScalarParser.EMPTY_RESULT
+
+
+_inline_comment_pattern = re.compile(r"(/\*.*?\*/)")
 
 
 def extract_inline_comments(s: str):
-    comments: list[str] = _inline_comment_pattern.findall(s)
-    code = _inline_comment_pattern.sub("", s)
+    # 单次扫描: split 的结果为 [code, comment, code, comment, ..., code]
+    parts = _inline_comment_pattern.split(s)
+    if len(parts) == 1:
+        return [], s
+    comments: list[str] = parts[1::2]
+    code = "".join(parts[::2])
     return comments, code
 
 
+LINE_SEPARATOR_PATTERN = re.compile(r"(:=|=>|>>|<>)")
+
+
 def split_by_first_sep(sep_group: re.Pattern, s: str) -> tuple[str, str, str]:
     """
     Args:
         sep_group: 包含一个捕获组的分割符正则(编译)
+            DctTxt 的行分隔符为 LINE_SEPARATOR_PATTERN
     Returns:
         三元组 (前缀, 分隔符, 后缀)
         如果没有分隔符，返回 (原串, "", "")
@@ -209,11 +399,15 @@ def split_by_first_sep(sep_group: re.Pattern, s: str) -> tuple[str, str, str]:
     return (parts[0], parts[1], parts[2]) if len(parts) == 3 else (s, "", "")
 
 
-@lru_cache(maxsize=128)
+# 排序和分桶时对每个键都会调用, 缓存要能覆盖整个字典
+@lru_cache(maxsize=65536)
 def _normalize_to_ascii(s: str) -> str:
     normalized = unicodedata.normalize("NFKD", s)
     return "".join(c for c in normalized if unicodedata.category(c) != "Mn")
 
 
 def normalize_to_ascii(s: str):
+    # ASCII 经 NFKD 不变, 也不含组合字符
+    if s.isascii():
+        return s
     return _normalize_to_ascii(s)
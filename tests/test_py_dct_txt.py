@@ -11,7 +11,10 @@ import pytest
 
 from py_dct_txt import DctTxt, DctTxtItem, DctTxtStore
 from py_dct_txt.utils import (
+    LINE_SEPARATOR_PATTERN,
     extract_inline_comments,
+    fast_emit_scalar,
+    json_flow_loads,
     normalize_to_ascii,
     split_by_first_sep,
     yaml_flow_dumps,
@@ -85,6 +88,10 @@ class TestUtils:
         assert sep == ":="
         assert suffix == ""
 
+        # DctTxt 使用的分隔符正则
+        parts = split_by_first_sep(LINE_SEPARATOR_PATTERN, "key >> 1")
+        assert parts == ("key ", ">>", " 1")
+
     def test_yaml_flow_roundtrip(self):
         """测试YAML流格式的序列化和反序列化"""
         test_data = {"name": "test", "value": 123, "items": [1, 2, 3]}
@@ -116,6 +123,32 @@ class TestUtils:
         reconstructed = yaml_flow_loads(yaml_str)
         assert reconstructed["float_val"] == 3.14
 
+    def test_fast_emit_scalar(self):
+        """测试标量快速输出与 yaml_flow_dumps 一致"""
+        values = [
+            *(0, -12, 10**20, 1.5, 1e20, -0.0, float("inf"), True, False),
+            *("abc", "a b", "中文", "café", "a, b", "Y"),
+        ]
+        for v in values:
+            assert fast_emit_scalar(v) == yaml_flow_dumps(v).removesuffix("\n...")
+
+        # 需要引号或完整 YAML 输出的值
+        for v in ["", " x", "yes", "123", "1_0", "null", "a:b", "...", "🎉"]:
+            assert fast_emit_scalar(v) is None
+        assert fast_emit_scalar([1, 2]) is None
+        assert fast_emit_scalar({"a": 1}) is None
+
+    def test_json_flow_loads(self):
+        """测试 JSON 兼容的 flow 集合与 YAML 解析结果一致"""
+        cases = ['[1, -0, 0.5, true, null, "a b"]', '{"k": [1e5, 1.0e+5]}', "[]"]
+        for s in cases:
+            assert json_flow_loads(s) == yaml_flow_loads("{v: " + s + "}")["v"]
+        assert json_flow_loads('{"k": [1e5]}') == {"k": ["1e5"]}
+
+        # 交给 YAML 处理的情况
+        for s in ["{a: 1}", "[a, b]", "[.nan]", "[NaN]", '["\\x41"]', "[1, 2,]", "1"]:
+            assert json_flow_loads(s) == ()
+
     def test_normalize_to_ascii(self):
         """测试Unicode到ASCII标准化"""
         # 带重音符号的字符
@@ -172,6 +205,7 @@ class TestDctTxt:
         assert result[0][1] == "key1"  # 键
         assert result[0][2] == ":="  # 分隔符
         assert "value1" in result[0][3]  # 值
+        assert result[4] == result[5] == ("", "", "", "", [])
 
     def test_read_as_list_complex(self, dct_txt, complex_sample_data):
         """测试复杂解析场景"""
@@ -213,6 +247,69 @@ class TestDctTxt:
         assert "name" in key4_item.kvs
         assert key4_item.kvs["name"] == "test"
 
+    def test_load_dict_scalar_values(self, dct_txt):
+        """测试标量值快速解析"""
+        lines = [
+            "k_int >> 42",
+            "k_float >> 1.5",
+            "k_bool >> true",
+            "k_null >> ~",
+            "k_str >> 普通字符串",
+            "k_quoted >> 'it''s'",
+            'k_escaped >> "\\x41"',
+            "k_list >> [1, {a: b}]",
+            "k_empty <>",
+            "k_blank <>   ",
+            "k_no_colon <> a, b: 1",
+        ]
+        data_dict, _ = dct_txt.load_dict(dct_txt.read_as_list(lines))
+
+        assert data_dict["k_int"].v == 42
+        assert data_dict["k_float"].v == 1.5
+        assert data_dict["k_bool"].v is True
+        assert data_dict["k_null"].v is None
+        assert data_dict["k_str"].v == "普通字符串"
+        assert data_dict["k_quoted"].v == "it's"
+        assert data_dict["k_escaped"].v == "A"
+        assert data_dict["k_list"].v == [1, {"a": "b"}]
+        assert data_dict["k_empty"].kvs == {}
+        assert data_dict["k_blank"].kvs == {}
+        # key: null 可以略写为 key
+        assert data_dict["k_no_colon"].kvs == {"a": None, "b": 1}
+
+    def test_scalar_values_yaml_typing(self, dct_txt):
+        """测试标量按 YAML 1.1 解析, 且字符串保存后重新加载不变"""
+        lines = ["k1 >> 1e5", "k2 >> yes", "k3 >> 1_000", "k4 >> 017", "k5 >> .iNf"]
+        # 逗号是 {v: ...} 中的 flow 分隔符
+        lines += ["k6 >> 1,2", "k7 >> x, y", "k8 >> x, y: 1", "k9 >> '''a'"]
+        data_dict, _ = dct_txt.load_dict(dct_txt.read_as_list(lines))
+        expected = ["1e5", True, 1000, 15, ".iNf", 1, "x", "x", "'a"]
+        assert [data_dict[f"k{i}"].v for i in range(1, 10)] == expected
+
+        values = [
+            *("1e5", "0o17", "1.5e3", "1e+5", ".iNf", "yes", "on", "1_000", "017"),
+            *(True, 1000, 15, 1e5, "٣"),
+            # 含转义的双引号字符串
+            *("\t\\a", "é\t\\0x", "\\\\e", "a\x85b", "\\101", "'x'"),
+        ]
+        items = {f"k{i}": DctTxtItem(k=f"k{i}", v=v) for i, v in enumerate(values)}
+        rows = dct_txt.save_list(dct_txt.dump_dict(items))
+        reloaded, _ = dct_txt.load_dict(dct_txt.read_as_list(rows))
+        for key, item in items.items():
+            assert type(reloaded[key].v) is type(item.v)
+            assert reloaded[key].v == item.v
+
+    def test_bind_handler_override(self):
+        """测试子类可以覆盖分隔符的处理方法"""
+
+        class UpperDctTxt(DctTxt):
+            def _bind_s(self, current, list_item, deferred):
+                current.s = list_item[3].strip().upper()
+
+        dct_txt = UpperDctTxt()
+        data_dict, _ = dct_txt.load_dict(dct_txt.read_as_list(["k => abc"]))
+        assert data_dict["k"].s == "ABC"
+
     def test_roundtrip_basic(self, dct_txt, sample_data):
         """测试基本往返转换"""
         # 读取为字典
@@ -290,6 +387,19 @@ class TestDctTxt:
         total_items = sum(len(batch) for batch in batches)
         assert total_items == len(dct_list)  # 应该保持总数不变
 
+    def test_save_list_streaming(self, dct_txt, complex_sample_data):
+        """测试分批写入与直接返回结果一致"""
+        import io
+
+        dct_list = dct_txt.read_as_list(complex_sample_data * 3)
+        lines = dct_txt.save_list(dct_list)
+        assert len(lines) == len(dct_list)
+
+        for batch_size in (1, 4, len(dct_list), 10000):
+            buf = io.StringIO()
+            assert dct_txt.save_list(dct_list, buf, batch_size=batch_size) == []
+            assert buf.getvalue() == "\n".join(lines)
+
     def test_format_list_item(self, dct_txt):
         """测试列表项格式化"""
         test_item = (
@@ -355,10 +465,13 @@ class TestDctTxtStore:
         assert DctTxtStore.extract_groupname("group1.dct.txt") == "group1"
         assert DctTxtStore.extract_groupname("group1__123.dct.txt") == "group1"
         assert DctTxtStore.extract_groupname("test_group.dct.txt") == "test_group"
+        assert DctTxtStore.extract_groupname("a__b.dct.txt") == "a__b"
+        assert DctTxtStore.extract_groupname("a__1__2.dct.txt") == "a__1"
 
         # 异常文件名
         assert DctTxtStore.extract_groupname("invalid.txt") == "unknown"
         assert DctTxtStore.extract_groupname("no_extension") == "unknown"
+        assert DctTxtStore.extract_groupname(".dct.txt") == "unknown"
 
     def test_create_index_map_basic(self, store):
         """测试基本索引映射创建"""
@@ -419,6 +532,20 @@ class TestDctTxtStore:
         assert "key2" in transposed
         assert "key3" in transposed
 
+    def test_transpose_dict_keys(self):
+        """测试只转置部分键"""
+        nested_dict = {
+            "key1": {"g1": DctTxtItem(k="key1"), "g2": DctTxtItem(k="key1")},
+            "key2": {"g2": DctTxtItem(k="key2")},
+            "key3": {"g3": DctTxtItem(k="key3")},
+        }
+
+        transposed = DctTxtStore.transpose_dict(nested_dict, ["key2", "key1"])
+
+        assert list(transposed) == ["g2", "g1"]
+        assert list(transposed["g2"]) == ["key2", "key1"]
+        assert "g3" not in transposed
+
     def test_load_basic(self, store, sample_files_structure):
         """测试基本文件加载"""
         data = store.load(sample_files_structure)
@@ -429,6 +556,49 @@ class TestDctTxtStore:
         assert len(data["key1"]) == 2
         assert "group1" in data["key1"] and "group2" in data["key1"]
 
+    def test_load_max_workers(self, sample_files_structure):
+        """测试串行与多线程加载结果一致"""
+        serial = DctTxtStore(max_workers=1).load(sample_files_structure)
+        parallel = DctTxtStore(max_workers=4).load(sample_files_structure)
+        assert serial == parallel
+        assert list(serial) == list(parallel)
+
+    def test_load_parse_cache(self, tmp_path, monkeypatch):
+        """测试重复加载使用解析缓存, 文件变化后重新解析"""
+        file = tmp_path / "group1.dct.txt"
+        file.write_text("key1 := a\n", encoding="utf-8")
+
+        def count_parses(store):
+            calls = []
+            iter_as_list = store.serializer.iter_as_list
+
+            def spy(fp):
+                calls.append(fp)
+                return iter_as_list(fp)
+
+            monkeypatch.setattr(store.serializer, "iter_as_list", spy)
+            return calls
+
+        # 默认不缓存
+        store = DctTxtStore()
+        calls = count_parses(store)
+        store.load(tmp_path)
+        store.load(tmp_path)
+        assert len(calls) == 2
+
+        store = DctTxtStore(parse_cache_size=8)
+        calls = count_parses(store)
+        first = store.load(tmp_path)
+        second = store.load(tmp_path)
+        assert len(calls) == 1
+        assert first == second
+        # 缓存的结果不共享可变对象
+        assert first["key1"]["group1"] is not second["key1"]["group1"]
+
+        file.write_text("key1 := a || bb\n", encoding="utf-8")
+        assert store.load(tmp_path)["key1"]["group1"].l == ["a", "bb"]
+        assert len(calls) == 2
+
     def test_load_nonexistent_path(self, store, tmp_path):
         """测试加载不存在的路径"""
         non_existent = tmp_path / "nonexistent"
@@ -458,6 +628,28 @@ class TestDctTxtStore:
         assert "key1" in reloaded_data
         assert len(reloaded_data["key1"]) == 2
 
+    def test_save_info_file(self, store, sample_files_structure, tmp_path):
+        """测试保存信息文件"""
+        import json
+
+        data = store.load(sample_files_structure)
+        data["empty_key"] = {"group4": DctTxtItem(k="empty_key")}
+
+        output_dir = tmp_path / "output"
+        store.save(data, output_dir)
+
+        info = json.loads(
+            (output_dir / DctTxtStore.saved_info_filename).read_text(encoding="utf-8")
+        )
+        assert list(info) == ["group1", "group2", "group3"]
+        assert info["group1"] == {"start": "key1", "end": "key2", "total": 2}
+        assert not (output_dir / "group4.dct.txt").exists()
+
+        # 没有任何内容需要保存时不创建目录
+        empty_dir = tmp_path / "empty_output"
+        store.save({"k": {"g": DctTxtItem(k="k")}}, empty_dir)
+        assert not empty_dir.exists()
+
     def test_file_line_iter(self, tmp_path):
         """测试文件行迭代器"""
         # 创建测试文件
@@ -635,13 +827,15 @@ class TestPerformance:
         test_data = [f"key_{i} := value_{i}" for i in range(1000)]
 
         tracemalloc.start()
+        try:
+            # 执行操作
+            dct_list = dct_txt.read_as_list(test_data)
+            data_dict, _ = dct_txt.load_dict(dct_list)
 
-        # 执行操作
-        dct_list = dct_txt.read_as_list(test_data)
-        data_dict, _ = dct_txt.load_dict(dct_list)
-
-        current, peak = tracemalloc.get_traced_memory()
-        tracemalloc.stop()
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            # 出错时也要停止跟踪, 以免拖慢后续的性能测试
+            tracemalloc.stop()
 
         # 峰值内存使用应该在合理范围内
         assert peak < 1 * 1024 * 1024, f"内存使用过高: {peak}字节"  # 小于1MB
@@ -674,6 +868,42 @@ class TestErrorScenarios:
         # 应该能够优雅处理
         assert True
 
+    def test_malformed_rows_isolated(self, dct_txt):
+        """测试批量解析时错误行不影响其他行"""
+        lines = [f"key_{i} >> [{i}, {{n: {i}}}]" for i in range(20)]
+        lines.insert(7, "bad_list >> [1, 2")
+        lines.insert(13, "bad_dict <> a: }")
+        lines.append("good_dict <> a: 1, b: [x]")
+        # 未闭合的引号和多余的 }, { 不能与相邻的行拼在一起
+        lines += ["q_a >> 'abc", "q_b >> x'", "q_c >> 1}, {v: 2"]
+        lines += ["kq_a <> k: 'abc", "kq_b <> k: x'", "kq_c <> k: 1}, {k: 2"]
+        data_dict, _ = dct_txt.load_dict(dct_txt.read_as_list(lines))
+
+        assert data_dict["bad_list"].v is None
+        assert data_dict["bad_dict"].kvs == {}
+        assert [data_dict[k].v for k in ("q_a", "q_b", "q_c")] == [None, "x'", None]
+        assert data_dict["kq_a"].kvs == {}
+        assert data_dict["kq_b"].kvs == {"k": "x'"}
+        assert data_dict["kq_c"].kvs == {}
+        for i in range(20):
+            assert data_dict[f"key_{i}"].v == [i, {"n": i}]
+        assert data_dict["good_dict"].kvs == {"a": 1, "b": ["x"]}
+
+    def test_yaml_alias_not_shared_across_rows(self, dct_txt):
+        """测试锚点和别名不会跨行解析"""
+        lines = ["a >> &x [1, 2]"]
+        # 中间的行走 json 快速路径, 不进入批量文档
+        lines += [f"k{i} >> [{i}]" for i in range(300)]
+        lines += ["b >> *x", "c <> k: *x", "d >> [&y 1, *y]"]
+        data_dict, _ = dct_txt.load_dict(dct_txt.read_as_list(lines))
+
+        assert data_dict["a"].v == [1, 2]
+        assert data_dict["b"].v is None
+        assert data_dict["c"].kvs == {}
+        # 同一行内的锚点仍然有效
+        assert data_dict["d"].v == [1, 1]
+        assert data_dict["k299"].v == [299]
+
     def test_unicode_handling(self, dct_txt, tmp_path):
         """测试Unicode字符处理"""
         # 包含各种Unicode字符